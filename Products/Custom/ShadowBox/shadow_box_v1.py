@@ -5,9 +5,11 @@ from tkinter.filedialog import askopenfilenames
 
 class ImageManager:
     def __init__(self, resize: tuple = None, *, 
-                 image_extensions: tuple = ("Image File","*.jpg *.jpeg *.png *.gif *.bmp *.tiff")) -> None:
+                 image_extensions: tuple = ("Image File","*.jpg *.jpeg *.png *.gif *.bmp *.tiff"),
+                 paths: tuple = None) -> None:
         
-        self.paths = askopenfilenames(title="Select one or more images", filetypes=[image_extensions])
+        if paths is None: self.paths = askopenfilenames(title="Select one or more images", filetypes=[image_extensions])
+        else: self.paths = tuple(paths)
         
         self.images = list()
         self.images_sizes = list()
@@ -29,6 +31,7 @@ class ImageManager:
         del tshape
 
 
-img_manager = ImageManager()
-img_manager.run()
+if __name__ == "__main__":
+    img_manager = ImageManager()
+    img_manager.run()
 
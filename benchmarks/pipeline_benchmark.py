@@ -0,0 +1,564 @@
+"""
+End-to-end performance benchmarks for the engraving pipeline.
+
+Every case runs in a fresh child process so its peak RSS is not polluted by the
+cases that ran before it, and synthetic inputs are generated in the parent so
+the RSS growth of the timed workload is all that gets compared. Results (wall
+time, peak RSS and throughput) are written to JSON and compared against a
+stored baseline, which records the median of several runs of each case. A
+regressing case is re-run to confirm it and only counts when its best run is
+still too slow. The script exits with a non-zero status when a case regresses
+or fails, and, unless --allow-skips is given, when a case with a comparable
+baseline was skipped. Cases without a baseline recorded on this environment
+are reported but not compared.
+
+Baselines hold absolute numbers and are only meaningful on the machine they
+were recorded on, so benchmarks/baseline.json is not versioned. Record one
+locally before making changes, then compare after:
+
+    python benchmarks/pipeline_benchmark.py --update-baseline
+    python benchmarks/pipeline_benchmark.py
+
+Usage:
+    python benchmarks/pipeline_benchmark.py
+    python benchmarks/pipeline_benchmark.py --update-baseline
+    python benchmarks/pipeline_benchmark.py --only image_load --repeat 10
+    python benchmarks/pipeline_benchmark.py --allow-skips    # e.g. headless, no Tk display
+"""
+import argparse, contextlib, importlib.util, json, logging, math, os, platform, statistics, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from Config.setup import *
+
+benchmark_log = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+benchmark_log.addHandler(HANDLER)
+benchmark_log.setLevel(LOGLEVEL)
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+SHADOW_BOX_PATH = os.path.join(ROOT_PATH, "Products", "Custom", "ShadowBox")
+SHADOW_BOX_IMAGES = ("normal_image.png", "black_image.png", "white_image.png")
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), "latest.json")
+
+IMAGE_SCALES = (1, 2, 3)
+RESIZE_TARGET = (1000, 647)
+WIDGET_TREES = ((3, 4), (4, 5), (6, 4))
+USB_PORT_COUNTS = (16, 256, 1024)
+
+# Fast workloads are looped inside each sample until it lasts at least this long.
+MIN_SAMPLE_TIME = 0.25
+
+# Allowed relative increase of the fastest per-call wall time, by case name prefix. The USB
+# probes are short pure-Python loops whose speed swings the most with load on the machine.
+TIME_TOLERANCES = {"image_load/": 0.25, "widget_tree/": 0.25, "usb_detector/": 0.5}
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    """Return a memory field of /proc/self/status (Linux only) in MiB."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return round(int(line.split()[1]) / 1024, 2)
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak RSS of the current process so it only covers what follows (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Return the peak resident set size of the current process in MiB, if available."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None or resource is None:
+        return peak
+    # ru_maxrss survives fork/exec, so it also carries the parent's peak. Linux reports KiB, macOS bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+
+
+def _load_shadow_box_module():
+    """Import shadow_box_v1 by path, the ShadowBox folder is not a package."""
+    spec = importlib.util.spec_from_file_location("shadow_box_v1", os.path.join(SHADOW_BOX_PATH, "shadow_box_v1.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---------------------------------------------------------------- Synthetic inputs
+
+def build_image_inputs(work_dir: str, scale: int) -> Tuple[List[str], float]:
+    """
+    Writes the bundled ShadowBox PNGs upscaled by an integer factor.
+
+    Args:
+        work_dir (str): Directory where the synthetic images are written.
+        scale (int): Upscale factor applied to both dimensions.
+
+    Returns:
+        tuple: Paths to the synthetic images and their total size in megapixels.
+    """
+    import cv2
+
+    paths, megapixels = list(), 0.0
+    for name in SHADOW_BOX_IMAGES:
+        image = cv2.imread(os.path.join(SHADOW_BOX_PATH, name), cv2.IMREAD_UNCHANGED)
+        if scale != 1:
+            image = cv2.resize(image, (image.shape[1] * scale, image.shape[0] * scale), interpolation=cv2.INTER_NEAREST)
+        path = os.path.join(work_dir, f"x{scale}_{name}")
+        cv2.imwrite(path, image)
+        paths.append(path)
+        megapixels += image.shape[0] * image.shape[1] / 1e6
+    return paths, megapixels
+
+
+def build_widget_tree(root, branching: int, depth: int) -> int:
+    """
+    Builds a deterministic tree of packed frames with labels as leaves.
+
+    Args:
+        root (tk.Tk): The root window the tree hangs from.
+        branching (int): Number of children per container.
+        depth (int): Number of levels below the root.
+
+    Returns:
+        int: Number of widgets created.
+    """
+    import tkinter as tk
+
+    count = 0
+    def grow(parent, level):
+        nonlocal count
+        for index in range(branching):
+            if level == depth:
+                widget = tk.Label(parent, text=f"{level}.{index}", name=f"label_{level}_{index}")
+            else:
+                widget = tk.Frame(parent, name=f"frame_{level}_{index}")
+                grow(widget, level + 1)
+            widget.pack(side="left" if level % 2 else "top")
+            count += 1
+    grow(root, 1)
+    return count
+
+
+class FakePort:
+    """Stand-in for a serial.tools.list_ports ListPortInfo entry."""
+
+    def __init__(self, index: int, manufacturer: str) -> None:
+        self.device = f"/dev/ttyFAKE{index}"
+        self.name = f"ttyFAKE{index}"
+        self.description = f"Fake port {index}"
+        self.hwid = f"USB VID:PID=1A86:7523 SER={index:08d}"
+        self.vid = 0x1A86
+        self.pid = 0x7523
+        self.serial_number = f"{index:08d}"
+        self.location = f"1-{index}"
+        self.manufacturer = manufacturer
+        self.product = "USB Serial"
+        self.interface = None
+
+
+class FakeSerial:
+    """
+    Stand-in for serial.Serial that only answers on one port at one baudrate,
+    so the detector walks every other port/baudrate combination first.
+    """
+
+    answer = (None, None)
+
+    def __init__(self, port: str, baudrate: int, timeout: float = None) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.is_open = True
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def read_until(self) -> bytes:
+        if (self.port, self.baudrate) == FakeSerial.answer:
+            return b"[VER:1.1f.20170801:]\r\n"
+        return b""
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+def build_fake_ports(count: int, brands: List[str]) -> List[FakePort]:
+    """Every other port belongs to a supported brand, the rest are filtered out."""
+    return [FakePort(index, brands[0] if index % 2 else "FTDI") for index in range(count)]
+
+
+# ---------------------------------------------------------------- Cases
+
+def _measure(workload: Callable[[], None], repeat: int) -> Dict:
+    """
+    Times a workload and the RSS it adds on top of the already set up process.
+
+    A first untimed call calibrates how many calls fit in MIN_SAMPLE_TIME, every
+    sample then loops that many calls and records the time per call.
+
+    Args:
+        workload (callable): The code under measurement.
+        repeat (int): Number of timed samples.
+
+    Returns:
+        dict: Per-call timings, calls per sample, the peak RSS while the workload ran
+        and how much of it the workload added, both in MiB.
+    """
+    rss_before = _proc_status_mb("VmRSS") if _reset_peak_rss() else _peak_rss_mb()
+
+    start = time.perf_counter()
+    workload()
+    first = time.perf_counter() - start
+    inner = max(1, math.ceil(MIN_SAMPLE_TIME / first)) if first > 0 else 1000
+
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(inner):
+            workload()
+        timings.append((time.perf_counter() - start) / inner)
+
+    rss_after = _peak_rss_mb()
+    workload_rss = round(rss_after - rss_before, 2) if rss_before is not None and rss_after is not None else None
+    return {"timings": timings, "inner": inner, "peak_rss_mb": rss_after, "workload_rss_mb": workload_rss}
+
+
+def bench_image_load(inputs: Tuple[List[str], float], resize: Optional[Tuple[int, int]], repeat: int) -> Dict:
+    """Times ImageManager decoding (and resizing) the upscaled ShadowBox images."""
+    shadow_box = _load_shadow_box_module()
+    paths, megapixels = inputs
+
+    def workload():
+        manager = shadow_box.ImageManager(resize, paths=paths)
+        # ImageManager prints every image it reads, keep that out of the console.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            manager.run()
+
+    return {**_measure(workload, repeat), "units": megapixels, "unit": "MP"}
+
+
+def bench_widget_tree(branching: int, depth: int, repeat: int) -> Dict:
+    """Times TKWidgetTree.get_widget_tree snapshots of a generated widget tree."""
+    import tkinter as tk
+    from utils import tk_widget_tree
+
+    tk_widget_tree.tkwidget_tree_log.setLevel(logging.WARNING)
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {"skipped": f"Tk unavailable: {e}"}
+
+    try:
+        widgets = build_widget_tree(root, branching, depth)
+        root.update()
+        viewer = tk_widget_tree.TKWidgetTree(root, clock=0)
+        measurement = _measure(viewer.get_widget_tree, repeat)
+    finally:
+        root.destroy()
+
+    return {**measurement, "units": widgets + 1, "unit": "widgets"}
+
+
+def bench_usb_detector(port_count: int, repeat: int) -> Dict:
+    """Times USBDeviceDetector.run against a fake port layer."""
+    from utils import usb_detector
+
+    usb_detector.usb_detector_log.setLevel(logging.CRITICAL)
+    detector = usb_detector.USBDeviceDetector()
+    ports = build_fake_ports(port_count, detector.brands)
+    supported = [port for port in ports if port.manufacturer in detector.brands]
+    FakeSerial.answer = (supported[-1].device, detector.baudrates[-1]) if supported else (None, None)
+
+    usb_detector.list_ports.comports = lambda: ports
+    usb_detector.serial.Serial = FakeSerial
+
+    return {**_measure(detector.run, repeat), "units": len(supported) * len(detector.baudrates), "unit": "probes"}
+
+
+def build_cases(scales: Tuple[int, ...] = IMAGE_SCALES,
+                image_inputs: Optional[Dict[int, Tuple[List[str], float]]] = None) -> Dict[str, Tuple[Callable, tuple]]:
+    """
+    Lists every benchmark case by name.
+
+    Args:
+        scales (tuple of int): Upscale factors for the image cases.
+        image_inputs (dict): Scale mapped to the output of build_image_inputs, None when only listing names.
+
+    Returns:
+        dict: Case name mapped to its function and positional arguments (without repeat).
+    """
+    image_inputs = image_inputs or dict()
+    cases = dict()
+    for scale in scales:
+        cases[f"image_load/decode/x{scale}"] = (bench_image_load, (image_inputs.get(scale), None))
+        cases[f"image_load/resize/x{scale}"] = (bench_image_load, (image_inputs.get(scale), RESIZE_TARGET))
+    for branching, depth in WIDGET_TREES:
+        cases[f"widget_tree/snapshot/b{branching}d{depth}"] = (bench_widget_tree, (branching, depth))
+    for port_count in USB_PORT_COUNTS:
+        cases[f"usb_detector/probe/p{port_count}"] = (bench_usb_detector, (port_count,))
+    return cases
+
+
+def run_case(name: str, repeat: int, scales: Tuple[int, ...], image_inputs: Dict[int, Tuple[List[str], float]]) -> Dict:
+    """Runs one case inside the current (child) process and summarises it."""
+    function, args = build_cases(scales, image_inputs)[name]
+    raw = function(*args, repeat)
+    if "skipped" in raw:
+        return raw
+
+    median = statistics.median(raw["timings"])
+    return {
+        "repeat": repeat,
+        "inner_loops": raw["inner"],
+        "wall_time_min_s": round(min(raw["timings"]), 9),
+        "wall_time_median_s": round(median, 9),
+        "peak_rss_mb": raw["peak_rss_mb"],
+        "workload_rss_mb": raw["workload_rss_mb"],
+        "throughput": round(raw["units"] / median, 3) if median else None,
+        "throughput_unit": f"{raw['unit']}/s",
+    }
+
+
+# ---------------------------------------------------------------- Baseline
+
+def is_measured(result: Optional[Dict]) -> bool:
+    """Tells whether a result holds measurements rather than a skip or a failure."""
+    return bool(result) and "wall_time_median_s" in result
+
+
+def is_comparable(reference: Optional[Dict], env: Dict) -> bool:
+    """Tells whether a baseline entry holds measurements recorded on the given environment."""
+    return is_measured(reference) and reference.get("environment") == env
+
+
+def time_tolerance_for(name: str, override: Optional[float] = None) -> float:
+    """Return the wall time tolerance of a case, the override applies to every case when given."""
+    if override is not None:
+        return override
+    return next((tolerance for prefix, tolerance in TIME_TOLERANCES.items() if name.startswith(prefix)), 0.25)
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], time_tolerance: Optional[float], rss_tolerance: float,
+            rss_floor: float = 0.0) -> Dict[str, List[str]]:
+    """
+    Compares measured results against a baseline recorded on the same environment,
+    anything else is left to the caller.
+
+    Args:
+        results (dict): Case name mapped to its current measurements.
+        baseline (dict): Case name mapped to its stored measurements.
+        time_tolerance (float): Allowed relative increase of the fastest per-call wall time, None uses TIME_TOLERANCES.
+        rss_tolerance (float): Allowed relative increase of the workload RSS growth.
+        rss_floor (float): Absolute slack in MiB, keeps page-granularity noise on near-zero growth from failing.
+
+    Returns:
+        dict: Case name mapped to its regression messages, only regressing cases are present.
+    """
+    regressions = dict()
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if not is_measured(current) or not is_comparable(reference, current.get("environment")):
+            continue
+
+        messages = list()
+        # The fastest sample is the least disturbed by other load on the machine, as timeit recommends.
+        limit = reference["wall_time_min_s"] * (1 + time_tolerance_for(name, time_tolerance))
+        if current["wall_time_min_s"] > limit:
+            messages.append(f"min wall time {current['wall_time_min_s']:.6f}s > {limit:.6f}s "
+                            f"(baseline {reference['wall_time_min_s']:.6f}s)")
+
+        if current.get("workload_rss_mb") is not None and reference.get("workload_rss_mb") is not None:
+            limit = max(reference["workload_rss_mb"] * (1 + rss_tolerance), reference["workload_rss_mb"] + rss_floor)
+            if current["workload_rss_mb"] > limit:
+                messages.append(f"workload RSS {current['workload_rss_mb']:.2f}MiB > {limit:.2f}MiB "
+                                f"(baseline {reference['workload_rss_mb']:.2f}MiB)")
+
+        if messages:
+            regressions[name] = messages
+    return regressions
+
+
+def merge_baseline(baseline: Dict[str, Dict], results: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    Merges new results into a baseline, a skipped or failed result never replaces a measured entry.
+
+    Args:
+        baseline (dict): Case name mapped to its stored measurements.
+        results (dict): Case name mapped to its current measurements.
+
+    Returns:
+        dict: The merged baseline.
+    """
+    merged = dict(baseline)
+    for name, result in results.items():
+        if is_measured(result):
+            merged[name] = result
+        else:
+            benchmark_log.warning(f"Keeping the existing baseline for {name}, new result is not a measurement: {result}")
+    return merged
+
+
+def environment() -> Dict:
+    """Describes the machine the benchmarks ran on, baselines are only comparable on the same one."""
+    info = {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine()}
+    try:
+        import cv2
+        info["opencv"] = cv2.__version__
+    except ImportError:
+        info["opencv"] = None
+    return info
+
+
+def _write_json(path: str, data: Dict) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+        f.write("\n")
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _run_isolated(name: str, repeat: int, scales: Tuple[int, ...],
+                  image_inputs: Dict[int, Tuple[List[str], float]], env: Dict) -> Dict:
+    """Runs one case in a fresh process, an exception is recorded as a failed result."""
+    benchmark_log.info(f"Running {name}")
+    # A fresh process per case keeps peak RSS attributable to that case alone.
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_case, name, repeat, scales, image_inputs).result()
+    except Exception as e:
+        benchmark_log.exception(f"{name} failed")
+        result = {"failed": f"{type(e).__name__}: {e}"}
+    if is_measured(result):
+        result["environment"] = env
+    benchmark_log.info(f"{name}: {result}")
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Engraving pipeline performance benchmarks.")
+    parser.add_argument("--repeat", type=_positive_int, default=7, help="Timed samples per case.")
+    parser.add_argument("--scales", type=_positive_int, nargs="+", default=list(IMAGE_SCALES), help="Upscale factors for the ShadowBox images.")
+    parser.add_argument("--only", nargs="+", default=None, help="Run only cases whose name starts with one of these prefixes.")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Where to write the results JSON.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Merge the measured results into the baseline.")
+    parser.add_argument("--allow-skips", action="store_true", help="Do not fail on skipped cases that have a comparable baseline.")
+    parser.add_argument("--retries", type=int, default=3, help="Re-runs of a regressing case before it counts, or extra runs per case when recording a baseline.")
+    parser.add_argument("--time-tolerance", type=float, default=None, help="Allowed relative wall time increase for every case, overrides TIME_TOLERANCES.")
+    parser.add_argument("--rss-tolerance", type=float, default=0.15, help="Allowed relative workload RSS increase.")
+    parser.add_argument("--rss-floor", type=float, default=1.0, help="Absolute workload RSS slack in MiB.")
+    args = parser.parse_args()
+
+    scales = tuple(args.scales)
+    names = [name for name in build_cases(scales) if not args.only or name.startswith(tuple(args.only))]
+    if not names:
+        benchmark_log.error(f"No benchmark case matches {args.only}")
+        return 2
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f).get("results", dict())
+    elif not args.update_baseline:
+        benchmark_log.warning(f"No baseline at {args.baseline}, run with --update-baseline to record one")
+
+    # With glibc's dynamic mmap threshold a freed frame may stay resident or not depending on
+    # allocation history, which flips the workload RSS of a case by a whole image between runs.
+    # A fixed threshold makes large buffers always go back to the OS. Spawned children inherit it.
+    os.environ.setdefault("MALLOC_MMAP_THRESHOLD_", "131072")
+
+    env = environment()
+    results, regressions = dict(), dict()
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_inputs = dict()
+        for scale in scales:
+            if any(name.startswith("image_load/") and name.endswith(f"/x{scale}") for name in names):
+                benchmark_log.info(f"Generating ShadowBox inputs at x{scale}")
+                image_inputs[scale] = build_image_inputs(work_dir, scale)
+
+        for name in names:
+            results[name] = _run_isolated(name, args.repeat, scales, image_inputs, env)
+            if args.update_baseline and is_measured(results[name]) and args.retries > 0:
+                # A single run may land in an unusually fast or slow window, record the typical one.
+                attempts = [results[name]] + [_run_isolated(name, args.repeat, scales, image_inputs, env)
+                                              for _ in range(args.retries)]
+                attempts = sorted((attempt for attempt in attempts if is_measured(attempt)), key=lambda attempt: attempt["wall_time_min_s"])
+                results[name] = attempts[(len(attempts) - 1) // 2]
+                benchmark_log.info(f"{name}: recording the median of {len(attempts)} runs")
+
+        if not args.update_baseline:
+            regressions = compare(results, baseline, args.time_tolerance, args.rss_tolerance, args.rss_floor)
+            for attempt in range(args.retries):
+                if not regressions:
+                    break
+                for name in regressions:
+                    benchmark_log.warning(f"{name} regressed ({'; '.join(regressions[name])}), "
+                                          f"re-running to confirm ({attempt + 1}/{args.retries})")
+                    rerun = _run_isolated(name, args.repeat, scales, image_inputs, env)
+                    if not is_measured(rerun) or rerun["wall_time_min_s"] < results[name]["wall_time_min_s"]:
+                        results[name] = rerun
+                regressions = compare({name: results[name] for name in regressions}, baseline,
+                                      args.time_tolerance, args.rss_tolerance, args.rss_floor)
+
+    _write_json(args.output, {"results": results})
+    benchmark_log.info(f"Results written to {args.output}")
+
+    failed = [name for name, result in results.items() if "failed" in result]
+    skipped = [name for name, result in results.items() if "skipped" in result]
+    if args.update_baseline:
+        _write_json(args.baseline, {"results": merge_baseline(baseline, results)})
+        benchmark_log.info(f"Baseline updated at {args.baseline}")
+        unchecked = list()
+    else:
+        unchecked = [name for name, result in results.items()
+                     if is_measured(result) and not is_comparable(baseline.get(name), env)]
+
+    # A skip only hides a regression when there was a comparable baseline to check against.
+    skipped_checked = [name for name in skipped if is_comparable(baseline.get(name), env)]
+
+    for name in skipped:
+        benchmark_log.warning(f"Skipped: {name} ({results[name]['skipped']})")
+    for name in unchecked:
+        reason = "recorded on a different environment" if is_measured(baseline.get(name)) else "missing"
+        benchmark_log.warning(f"Not compared: {name}, baseline {reason}, run with --update-baseline to record one")
+    for name in failed:
+        benchmark_log.error(f"Failed: {name} ({results[name]['failed']})")
+    for name, messages in regressions.items():
+        for message in messages:
+            benchmark_log.error(f"Regression: {name}: {message}")
+
+    if failed or regressions:
+        return 1
+    if skipped_checked and not args.allow_skips:
+        benchmark_log.error(f"{len(skipped_checked)} case(s) with a baseline skipped, pass --allow-skips to accept that")
+        return 1
+
+    benchmark_log.info("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())